@@ -0,0 +1,66 @@
+import numpy as np
+import os
+
+
+class Benchmark:
+    # The class of the ideal (all satellites working) revenue track
+    # It does not depend on the states or the strategy, so it is computed
+    # once for the ephemeris, the money grid and the grid step and cached
+    # on disk for every following run
+
+    def __init__(self, sim, folder: str = './PP_Data/benchmark'):
+        '''
+        sim -- simulation class object
+        folder -- folder of the cached tracks
+        '''
+        self.step = sim.step
+        # Key of the inputs the ideal revenue depends on, the same track is
+        # used by the runs of any length
+        self.key = sim.key(steps=False)
+        os.makedirs(folder, exist_ok=True)
+        self.path = os.path.join(folder, self.key + '.bin')   # Revenue
+        self.fin = os.path.join(folder, self.key + '.done')   # Computed
+        # The track covers the whole ephemeris file, a propagated one grows
+        # with the longest run
+        self.steps = max(getattr(sim.eph.source, 'steps', 0), sim.steps)
+        if os.path.isfile(self.path):
+            self.steps = max(self.steps, os.path.getsize(self.path) // 8)
+        # Create (or extend) the files before the workers map them, the new
+        # steps are not computed
+        for path, size in ((self.path, 8), (self.fin, 1)):
+            if (not os.path.isfile(path) or
+                    os.path.getsize(path) < self.steps*size):
+                with open(path, 'ab'):
+                    pass
+                os.truncate(path, self.steps*size)
+        self.vals = None
+        self.done = None
+
+    def open(self):
+        # Map the track files
+        if self.vals is None:
+            self.vals = np.memmap(self.path, dtype=np.float64, mode='r+',
+                                  shape=(self.steps,))
+            self.done = np.memmap(self.fin, dtype=bool, mode='r+',
+                                  shape=(self.steps,))
+
+    def get(self, start: int, stop: int):
+        # Return the ideal revenue of the range and the mask of the steps
+        # it has been computed for
+        self.open()
+        return (np.array(self.vals[start:stop]),
+                np.array(self.done[start:stop]))
+
+    def put(self, start: int, vals, mask):
+        # Store the ideal revenue of the steps of the range in the mask
+        self.open()
+        idx = start + np.nonzero(mask)[0]
+        self.vals[idx] = vals[mask]
+        self.done[idx] = True
+
+    def __getstate__(self):
+        # Every process maps the files by itself
+        state = self.__dict__.copy()
+        state['vals'] = None
+        state['done'] = None
+        return state
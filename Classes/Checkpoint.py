@@ -0,0 +1,110 @@
+import numpy as np
+import os
+import _pickle as pickle
+
+# Custom classes import
+from Classes.Runner import Results
+
+
+class Checkpoint:
+    # The class of the checkpoint of the long simulation
+    # Keeps the sampled states, the RNG state, the raw output and the
+    # finished timesteps, so that the interrupted run only does the rest
+
+    def __init__(self, path: str = './Output/checkpoint'):
+        '''
+        path -- folder of the checkpoint files
+        '''
+        self.path = path
+        self.meta = os.path.join(path, 'sim.data')   # States and RNG
+        self.res = os.path.join(path, 'results.bin')   # Raw output rows
+        self.fin = os.path.join(path, 'done.bin')   # Finished timesteps
+        self.done = None
+
+    def exists(self):
+        return os.path.isfile(self.meta)
+
+    def save(self, sim, output: str):
+        # Save the sampled states and the RNG state of a new simulation
+        # output -- .csv file the run exports to
+        os.makedirs(self.path, exist_ok=True)
+        data = {'n': sim.n, 'steps': sim.steps, 'step': sim.step,
+                'strat': sim.strat.str, 'key': sim.key(),
+                'states': sim.states,
+                'seed': sim.seed, 'rng': sim.rng.bit_generator.state,
+                'output': output}
+        with open(self.meta, 'wb') as f:
+            pickle.dump(data, f)
+        # Start with no finished timesteps
+        for path in (self.res, self.fin):
+            if os.path.isfile(path):
+                os.remove(path)
+
+    def restore(self, sim, seed=None):
+        # Put the saved states and RNG state into the simulation
+        # seed -- seed the run is asked for (any saved one if None)
+        # Returns the .csv file the run exports to
+        with open(self.meta, 'rb') as f:
+            data = pickle.load(f)
+        for key in ('n', 'steps', 'step'):
+            if data[key] != getattr(sim, key):
+                raise ValueError('Checkpoint has {} = {}, the simulation has '
+                                 '{}'.format(key, data[key],
+                                             getattr(sim, key)))
+        if data['strat'] != sim.strat.str:
+            raise ValueError('Checkpoint is made for the other strategy!')
+        if data.get('key') != sim.key():
+            raise ValueError('Checkpoint is made for the other configuration '
+                             '(market grid, ephemeris, grid or satellite)!')
+        if (seed is not None and
+                np.random.SeedSequence(seed).entropy != data['seed']):
+            raise ValueError('Checkpoint is made with seed = {}, the run '
+                             'asks for {}'.format(data['seed'], seed))
+        sim.states = data['states']
+        sim.seed = data['seed']
+        sim.rng.bit_generator.state = data['rng']
+        return data['output']
+
+    def results(self, steps: int):
+        # Raw output of the run in the memory-mapped file
+        return Results(steps, path=self.res)
+
+    def open(self, steps: int):
+        # Map the flags of the finished timesteps
+        if self.done is None:
+            mode = 'r+' if os.path.isfile(self.fin) else 'w+'
+            self.done = np.memmap(self.fin, dtype=bool, mode=mode,
+                                  shape=(steps,))
+        return self.done
+
+    def finished(self, ranges):
+        # Ranges of timesteps finished before
+        return [(st, en) for st, en in ranges if self.done[st:en].all()]
+
+    def missing(self, ranges):
+        # Ranges of timesteps to be scheduled
+        return [(st, en) for st, en in ranges if not self.done[st:en].all()]
+
+    def covered(self, ranges, rows: int):
+        # End of the leading finished ranges within the first rows, the
+        # export is kept up to it and the rest is written again
+        end = 0
+        for st, en in ranges:
+            if en > rows or not self.done[st:en].all():
+                break
+            end = en
+        return end
+
+    def mark(self, start: int, stop: int):
+        # Mark the range as finished, its rows must be in the results
+        self.done[start:stop] = True
+
+    def flush(self):
+        self.done.flush()
+
+    def clear(self):
+        # Remove the checkpoint of the finished run
+        self.done = None
+        for path in (self.meta, self.res, self.fin):
+            if os.path.isfile(path):
+                os.remove(path)
@@ -0,0 +1,221 @@
+import numpy as np
+from collections import OrderedDict
+R = 6378.137
+
+
+class Coverage:
+    # The class of the batched coverage engine for the whole constellation
+
+    def __init__(self, sat, acc: float, shape, block: int = 4000000,
+                 stencil: bool = False, cache: int = 512):
+        '''
+        sat -- satellite class object (altitude and antenna FOV)
+        acc -- step of the grid
+        shape -- shape of the money grid (360/acc, 180/acc)
+        block -- maximum number of candidate points evaluated at once
+        stencil -- snap focus points to the grid and use cached stencils
+                   (approximate, the exact search is used otherwise)
+        cache -- maximum number of latitude stencils kept in memory
+        '''
+        self.acc = acc
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.r = (sat.alt)*np.tan(np.pi * (sat.alfa/2)/180)   # Cov. radius
+        self.mdist = np.ceil(self.r/111)   # Maximum deviation in degrees
+        # Maximum number of grid points along one side of the search box
+        self.width = int(np.ceil((2*self.mdist + 2)/acc))
+        # Number of satellites processed at once
+        self.block = max(1, block // self.width**2)
+
+        # Stencils of (dlon, dlat) offsets for every latitude bin
+        self.stencil = stencil
+        self.cache = cache
+        self.stencils = OrderedDict()
+        self.table = None
+        if stencil:
+            # Precompute as many latitude bands as the cache can hold
+            bins = np.arange(-int(round(90/acc)), int(round(90/acc)) + 1)
+            for b in bins[np.argsort(np.abs(bins), kind='stable')][:cache]:
+                self.offsets(b)
+            if bins.size <= cache:
+                # All the bands fit, pad them to one table for the lookup
+                size = max(di.size for di, _ in self.stencils.values())
+                self.bin0 = bins[0]
+                self.table = (np.zeros((bins.size, size), dtype=np.int64),
+                              np.zeros((bins.size, size), dtype=np.int64),
+                              np.zeros((bins.size, size), dtype=bool))
+                for b in bins:
+                    di, dj = self.stencils[b]
+                    self.table[0][b - self.bin0, :di.size] = di
+                    self.table[1][b - self.bin0, :di.size] = dj
+                    self.table[2][b - self.bin0, :di.size] = True
+
+    def cells(self, lon, lat):
+        # Return the covered cells for all the satellites given
+        # lon, lat -- arrays of satellite antenna focus points on Earth
+        # Returns the flat indices of the money grid and the owner satellite
+        lon = np.asarray(lon, dtype=np.float64).ravel()
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        if self.stencil:
+            return self._stencil_cells(lon, lat)
+        flat = []
+        owner = []
+        for s in range(0, lon.size, self.block):
+            f, o = self._cells(lon[s:s + self.block], lat[s:s + self.block])
+            flat.append(f)
+            owner.append(o + s)
+        if len(flat) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(flat), np.concatenate(owner)
+
+    def _cells(self, lon, lat):
+        # Coverage of one block of satellites in one NumPy pass
+        acc = self.acc
+        k = np.arange(self.width)
+
+        # The search box around the focus point (same as the grid walk)
+        lon0 = np.floor(lon - self.mdist)
+        lat0 = np.floor(lat - self.mdist)
+        nlon = np.ceil((np.ceil(lon + self.mdist) - lon0)/acc)
+        nlat = np.ceil((np.ceil(lat + self.mdist) - lat0)/acc)
+
+        # Grid points of the box for every satellite (sat, i) and (sat, j)
+        i = lon0[:, None] + k[None, :]*acc
+        j = lat0[:, None] + k[None, :]*acc
+
+        # Calculate the distance and decide whether the point is in
+        # the circle or not
+        rlat = np.deg2rad(lat)[:, None, None]
+        rlon = np.deg2rad(lon)[:, None, None]
+        ri = np.deg2rad(i)[:, :, None]
+        rj = np.deg2rad(j)[:, None, :]
+        cos = (np.sin(rlat)*np.sin(rj) +
+               np.cos(rlat)*np.cos(rj)*np.cos(rlon - ri))
+        dist = R*np.arccos(np.clip(cos, -1., 1.))
+        inside = ((dist <= self.r) &
+                  (k[None, :, None] < nlon[:, None, None]) &
+                  (k[None, None, :] < nlat[:, None, None]))
+        sat, a, b = np.nonzero(inside)
+
+        # Grid indices, negative ones wrap around as for the money indexing
+        ix = (np.rint(lon0/acc).astype(np.int64)[sat] + a) % self.shape[0]
+        iy = (np.rint(lat0/acc).astype(np.int64)[sat] + b) % self.shape[1]
+        return ix*self.shape[1] + iy, sat
+
+    def offsets(self, b: int):
+        # Return the stencil of grid offsets for the latitude bin b
+        # The footprint only depends on the latitude of the focus point
+        b = int(b)
+        if b in self.stencils:
+            self.stencils.move_to_end(b)
+            return self.stencils[b]
+        flat, _ = self._cells(np.zeros(1), np.array([b*self.acc]))
+        di = flat // self.shape[1]
+        dj = flat % self.shape[1] - b % self.shape[1]
+        # Bring the offsets back from the wrapped grid indices
+        di = (di + self.shape[0]//2) % self.shape[0] - self.shape[0]//2
+        dj = (dj + self.shape[1]//2) % self.shape[1] - self.shape[1]//2
+        self.stencils[b] = (di, dj)
+        # Drop the least recently used stencil
+        if len(self.stencils) > self.cache:
+            self.stencils.popitem(last=False)
+        return di, dj
+
+    def snap(self, lon, lat):
+        # Grid indices of the focus points snapped to the grid
+        return (np.rint(np.asarray(lon, dtype=np.float64)/self.acc)
+                .astype(np.int64),
+                np.rint(np.asarray(lat, dtype=np.float64)/self.acc)
+                .astype(np.int64))
+
+    def _stencil_cells(self, lon, lat):
+        # Coverage as a stencil lookup shifted to the snapped focus points
+        return self.footprints(*self.snap(lon, lat))
+
+    def footprints(self, ix, iy):
+        # Covered cells of the focus points given by their grid indices
+        if self.table is not None:
+            # One gather from the padded table of all the latitude bands
+            b = iy - self.bin0
+            valid = self.table[2][b]
+            i = (ix[:, None] + self.table[0][b]) % self.shape[0]
+            j = (iy[:, None] + self.table[1][b]) % self.shape[1]
+            sat = np.nonzero(valid)[0]
+            return (i*self.shape[1] + j)[valid], sat
+        flat = []
+        owner = []
+        for b in np.unique(iy):
+            sat = np.nonzero(iy == b)[0]
+            di, dj = self.offsets(b)
+            i = (ix[sat, None] + di[None, :]) % self.shape[0]
+            j = (b + dj) % self.shape[1]
+            flat.append((i*self.shape[1] + j[None, :]).ravel())
+            owner.append(np.repeat(sat, di.size))
+        if len(flat) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return np.concatenate(flat), np.concatenate(owner)
+
+    def mask(self, lon, lat, out=None):
+        # Return the boolean mask over the money grid covered by satellites
+        if out is None:
+            out = np.zeros(self.shape, dtype=bool)
+        else:
+            out.fill(False)
+        flat, _ = self.cells(lon, lat)
+        out.ravel()[flat] = True
+        return out
+
+
+class Counts:
+    # The class of the incremental coverage of the money grid
+    # Keeps the number of operating satellites covering every cell and
+    # only updates the cells of the satellites that moved to another cell
+    # or changed the state since the last update
+
+    def __init__(self, cov, money, n: int, exact: int = 1000):
+        '''
+        cov -- coverage engine with the footprint stencils
+        money -- money grid
+        n -- number of satellites in the constellation
+        exact -- number of updates between the exact revenue recalculations
+        '''
+        if not cov.stencil:
+            raise TypeError('Incremental coverage needs the stencils!')
+        self.cov = cov
+        self.money = np.ravel(money)
+        self.count = np.zeros(self.money.size, dtype=np.int32)
+        # Snapped focus points and states of the last update
+        self.ix = np.zeros(n, dtype=np.int64)
+        self.iy = np.zeros(n, dtype=np.int64)
+        self.active = np.zeros(n, dtype=bool)
+        self.rev = 0.   # Money of the covered cells
+        self.exact = exact
+        self.updates = 0
+
+    def update(self, lon, lat, active):
+        # Move to the new focus points and states of the satellites
+        # active -- mask of the operating satellites
+        # Returns the money of the covered cells
+        ix, iy = self.cov.snap(lon, lat)
+        active = np.asarray(active, dtype=bool)
+        moved = (ix != self.ix) | (iy != self.iy)
+        rem = self.active & (moved | ~active)
+        add = active & (moved | ~self.active)
+
+        # Cells left by the satellites, lost if nobody covers them anymore
+        flat, _ = self.cov.footprints(self.ix[rem], self.iy[rem])
+        cell, num = np.unique(flat, return_counts=True)
+        self.count[cell] -= num
+        self.rev -= self.money[cell[self.count[cell] == 0]].sum()
+
+        # Cells entered by the satellites, new if nobody covered them
+        flat, _ = self.cov.footprints(ix[add], iy[add])
+        cell, num = np.unique(flat, return_counts=True)
+        self.rev += self.money[cell[self.count[cell] == 0]].sum()
+        self.count[cell] += num
+
+        self.ix, self.iy, self.active = ix, iy, active
+        # Get rid of the accumulated rounding error from time to time
+        self.updates += 1
+        if self.updates % self.exact == 0:
+            self.rev = np.dot(self.money, self.count > 0)
+        return self.rev
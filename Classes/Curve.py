@@ -0,0 +1,40 @@
+import numpy as np
+
+
+class Curve:
+    # The class of the piecewise-linear curve (e.g. rich-poor income curve)
+    # The points are converted to sorted arrays once, arrays of the values
+    # are interpolated at once
+
+    def __init__(self, points, out: str = 'raise'):
+        '''
+        points -- sequence of the [x, y] points of the curve
+        out -- policy for the values out of the curve range:
+               'raise' -- raise ValueError
+               'clip' -- take the value of the nearest end of the curve
+               'nan' -- return NaN
+        '''
+        if out not in ('raise', 'clip', 'nan'):
+            raise TypeError('Wrong out of range policy!')
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if points.shape[0] == 0:
+            raise ValueError('The curve has no points!')
+        order = np.argsort(points[:, 0], kind='stable')
+        self.x = points[order, 0]
+        self.y = points[order, 1]
+        self.out = out
+
+    def __call__(self, value, out=None):
+        # Interpolate the value or the array of values
+        # out -- policy for the values out of the curve range (the policy of
+        #        the curve if None)
+        out = self.out if out is None else out
+        value = np.asarray(value, dtype=np.float64)
+        res = np.interp(value, self.x, self.y)
+        if out != 'clip':
+            outside = (value < self.x[0]) | (value > self.x[-1])
+            if out == 'raise' and np.any(outside):
+                raise ValueError('Values out of the curve range [{}, {}]!'
+                                 .format(self.x[0], self.x[-1]))
+            res = np.where(outside, np.nan, res)
+        return res[()]
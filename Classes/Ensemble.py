@@ -0,0 +1,88 @@
+import numpy as np
+import datetime as dt
+import multiprocessing as mp
+
+# Custom classes import
+from Classes.Runner import cumulate
+from Classes.Runner import HEADER
+
+# Ensemble kept in the pool worker
+worker = {}
+
+
+def init(ens):
+    # Keep the ensemble in the worker
+    worker['ens'] = ens
+
+
+def block(rng):
+    # Run the range of steps (start, stop) of all the replicas in the worker
+    return worker['ens'].step_range_sim(*rng)
+
+
+class Ensemble:
+    # The class of the Monte Carlo ensemble over the reliability realisations
+    # All the replicas share the ephemeris and the market grid of the
+    # simulation, only the sampled satellite states differ
+
+    def __init__(self, sim, reps: int):
+        '''
+        sim -- simulation class object
+        reps -- number of replicas of the lifetime sampling
+        '''
+        self.sim = sim
+        self.reps = reps
+        # Every replica has its own random stream
+        self.states = [sim.status(sim.replica(r)) for r in range(reps)]
+
+    def step_range_sim(self, start, stop):
+        # Raw (reps, k, 7) output of the range of steps for all the replicas
+        return self.sim.replicas_sim(start, stop, self.states)
+
+    def run(self, start: int = 0, stop=None, q=(5, 50, 95), cpus: int = 1):
+        # Run the ensemble and return the mean and the percentiles q of the
+        # cumulative output as (k, 7) and (len(q), k, 7) arrays
+        # cpus -- number of processes running the blocks of steps
+        # Only one block of all the replicas is kept in memory, the
+        # cumulative sums go on from the last row of every replica
+        if stop is None:
+            stop = self.sim.steps
+        mean = np.empty((stop - start, 7))
+        pct = np.empty((len(q), stop - start, 7))
+        carry = np.zeros((self.reps, 5))
+        ranges = self.sim.eph.ranges(start, stop)
+        pl = None
+        shared = False   # Shared here, freed in the end
+        try:
+            if cpus == 1:
+                blocks = (self.step_range_sim(st, en) for st, en in ranges)
+            else:
+                # The workers get the ensemble once, the blocks come back
+                # in order
+                if not self.sim.shared:
+                    self.sim.share()
+                    shared = True
+                pl = mp.Pool(cpus, initializer=init, initargs=(self,))
+                blocks = pl.imap(block, ranges)
+            for (st, en), out in zip(ranges, blocks):
+                for r in range(self.reps):
+                    cumulate(out[r])
+                out[:, :, 2:] += carry[:, None, :]
+                carry = out[:, -1, 2:].copy()
+                mean[st - start:en - start] = out.mean(0)
+                pct[:, st - start:en - start] = np.percentile(out, q, axis=0)
+        finally:
+            if pl is not None:
+                pl.terminate()
+            if shared:
+                self.sim.unshare()
+        return mean, pct
+
+    def export(self, mean, pct, q=(5, 50, 95)):
+        # Export the mean and the percentile curves to the .csv files
+        now = dt.datetime.now().strftime("%d-%m %H:%M")
+        np.savetxt("./Output/{} mean.csv".format(now), mean,
+                   delimiter=',', fmt='%1.3f', header=HEADER)
+        for p, arr in zip(q, pct):
+            np.savetxt("./Output/{} p{}.csv".format(now, p), arr,
+                       delimiter=',', fmt='%1.3f', header=HEADER)
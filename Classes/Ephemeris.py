@@ -0,0 +1,154 @@
+import numpy as np
+import os
+import struct
+import tqdm
+from itertools import islice
+from collections import OrderedDict
+MAGIC = b'ADREPH01'   # File signature and format version
+FORMAT = '<8sqqd'   # Signature, steps, satellites and step size
+HEADER = 64   # Header size in bytes
+
+
+class Ephemeris:
+    # The class of the binary ephemeris store of the sub-satellite points
+    # Data is a raw float32 (steps, n, 2) array of [lat, lon] after the header
+
+    def __init__(self, path: str = './PP_Data/ephemeris.bin'):
+        '''
+        path -- binary ephemeris file written by Ephemeris.create
+        '''
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, steps, n, step = struct.unpack(
+                FORMAT, f.read(struct.calcsize(FORMAT)))
+        if magic != MAGIC:
+            raise TypeError('{} is not an ephemeris file!'.format(path))
+        self.steps = int(steps)   # Number of timesteps
+        self.n = int(n)   # Number of satellites
+        self.step = step   # Timestep size in seconds
+        # The memory map is opened once in every process that uses it
+        self.data = None
+
+    @staticmethod
+    def create(path: str, steps: int, n: int, step: float):
+        # Write the header and return the writable memory map of the data
+        with open(path, 'wb') as f:
+            f.write(struct.pack(FORMAT, MAGIC, steps, n, step).ljust(
+                HEADER, b'\0'))
+        return np.memmap(path, dtype=np.float32, mode='r+', offset=HEADER,
+                         shape=(steps, n, 2))
+
+    @staticmethod
+    def write(path: str, lat, lon, step: float):
+        # Write the (steps, n) arrays of latitudes and longitudes to the file
+        out = Ephemeris.create(path, lat.shape[0], lat.shape[1], step)
+        out[:, :, 0] = lat
+        out[:, :, 1] = lon
+        out.flush()
+        del out
+        return Ephemeris(path)
+
+    @staticmethod
+    def from_text(lat_path: str, lon_path: str, path: str, step: float,
+                  steps=None, block: int = 1000, progress: bool = True):
+        # Stream the GMAT lat/lon text dumps (a line of n values per step)
+        # into the binary file, only a block of lines is kept in memory
+        if steps is None:
+            # Count the timesteps without reading the file in memory
+            with open(lat_path, 'r') as f:
+                steps = sum(1 for line in f if line.strip())
+        with open(lat_path, 'r') as f:
+            n = len(f.readline().split())
+
+        out = Ephemeris.create(path, steps, n, step)
+        bar = tqdm.tqdm(total=steps, disable=not progress)
+        with open(lat_path, 'r') as flat, open(lon_path, 'r') as flon:
+            for st in range(0, steps, block):
+                k = min(block, steps - st)
+                # Parse the block of lines of both files at once
+                for j, f in enumerate((flat, flon)):
+                    vals = np.fromstring(' '.join(islice(f, k)),
+                                         dtype=np.float32, sep=' ')
+                    if vals.size != k*n:
+                        raise IndexError('Wrong number of values in the '
+                                         'block starting at step {}'
+                                         .format(st))
+                    out[st:st + k, :, j] = vals.reshape(k, n)
+                out.flush()
+                bar.update(k)
+        bar.close()
+        del out
+        return Ephemeris(path)
+
+    def key(self):
+        # Identity of the file content for the cached results
+        st = os.stat(self.path)
+        return ('file', os.path.abspath(self.path), self.steps, self.n,
+                self.step, st.st_size, st.st_mtime_ns)
+
+    def open(self):
+        # Map the data read-only, the page cache is shared by the processes
+        if self.data is None:
+            self.data = np.memmap(self.path, dtype=np.float32, mode='r',
+                                  offset=HEADER, shape=(self.steps, self.n, 2))
+        return self.data
+
+    def __getitem__(self, index):
+        # Zero-copy slice of the [lat, lon] data
+        return self.open()[index]
+
+    def __getstate__(self):
+        # Never pickle the mapped data, workers map the file by themselves
+        state = self.__dict__.copy()
+        state['data'] = None
+        return state
+
+
+class Chunks:
+    # The class of the chunk-aware provider of the sub-satellite points
+    # Keeps a few blocks of timesteps loaded (or generated) in the worker
+
+    def __init__(self, source, steps: int, size: int = 500, blocks: int = 4):
+        '''
+        source -- ephemeris file or propagator object indexed by timesteps
+        steps -- number of timesteps of the simulation
+        size -- number of timesteps in a block
+        blocks -- maximum number of blocks kept in memory
+        '''
+        self.source = source
+        self.steps = steps
+        self.size = size
+        self.blocks = blocks
+        self.cache = OrderedDict()
+
+    def block(self, num: int):
+        # Return the block of timesteps, load it if it is not in the cache
+        if num in self.cache:
+            self.cache.move_to_end(num)
+            return self.cache[num]
+        st = num*self.size
+        data = np.array(self.source[st:min(st + self.size, self.steps)])
+        self.cache[num] = data
+        # Drop the least recently used block
+        if len(self.cache) > self.blocks:
+            self.cache.popitem(last=False)
+        return data
+
+    def __getitem__(self, ts: int):
+        # Return the [lat, lon] of all the satellites at the timestep
+        num = ts // self.size
+        return self.block(num)[ts - num*self.size]
+
+    def ranges(self, start: int = 0, stop=None):
+        # Split the timesteps into contiguous ranges aligned to the blocks
+        if stop is None:
+            stop = self.steps
+        bounds = list(range((start // self.size + 1)*self.size, stop,
+                            self.size))
+        return list(zip([start] + bounds, bounds + [stop]))
+
+    def __getstate__(self):
+        # The loaded blocks stay in the process that loaded them
+        state = self.__dict__.copy()
+        state['cache'] = OrderedDict()
+        return state
@@ -43,6 +43,11 @@ class Trend:
             raise TypeError('Wrong type!')
 
     def __getitem__(self, index: int):
+        if np.ndim(index) > 0:
+            # The trend for the array of timesteps
+            index = np.asarray(index, dtype=np.float64)
+            return np.where(index > self.endt, self.end,
+                            self.res(np.minimum(index, self.endt)))
         if index > self.endt:
             return self.end
         else:
@@ -0,0 +1,43 @@
+import numpy as np
+import os
+
+
+class Lifetime:
+    # The class of the lifetime sampler for the reliability distribution
+
+    def __init__(self, size: int = 2207520, launch: float = .1, path=None):
+        '''
+        size -- number of lifetime steps in the reliability distribution
+        launch -- launch failure probability (lifetime of zero)
+        path -- .npz file to cache the cumulative table on disk
+        '''
+        self.size = size
+        self.launch = launch
+
+        # Take the cumulative table from the disk if it has been computed
+        # for the same distribution
+        if path is not None and os.path.isfile(path):
+            with np.load(path) as f:
+                if f['size'] == size and f['launch'] == launch:
+                    self.cdf = f['cdf']
+                    return
+
+        self.cdf = np.cumsum(self.pdf())
+        # Get rid of the rounding error in the end of the table
+        self.cdf /= self.cdf[-1]
+        if path is not None:
+            np.savez(path, cdf=self.cdf, size=size, launch=launch)
+
+    def pdf(self):
+        # The probability of every lifetime based on the reliability
+        # distribution, the last one is for the satellites that never fail
+        i = np.arange(1, self.size, dtype=np.float64)
+        p = np.empty(self.size + 1)
+        p[0] = self.launch
+        p[1:self.size] = .000120114*np.exp(-.000265681*i**.4521)/i**.5479
+        p[self.size] = 1 - p[:self.size].sum()
+        return p
+
+    def sample(self, size, rng=np.random):
+        # Draw the lifetimes by the inverse of the cumulative distribution
+        return np.searchsorted(self.cdf, rng.random(size), side='right')
@@ -0,0 +1,78 @@
+import numpy as np
+import os
+
+PARAMS = ['price', 'inter', 'adoption']   # Scenario parameters
+
+
+class Market:
+    # The class of the market grids of the pricing scenarios
+    # The grids are stacked in the memory-mapped (k, *shape) file, the
+    # parameters of every scenario are kept in the index next to it
+
+    def __init__(self, path: str = './PP_Data/market'):
+        '''
+        path -- folder of the scenario grids
+        '''
+        self.path = path
+        self.bin = os.path.join(path, 'grids.bin')   # Stacked grids
+        self.idx = os.path.join(path, 'index.npz')   # Parameters and shape
+        with np.load(self.idx) as f:
+            # NaN parameter -- the country's own value
+            self.params = f['params']
+            self.shape = tuple(f['shape'])
+        self.data = None
+
+    @classmethod
+    def create(cls, path: str, params, shape):
+        # Create the empty scenario file for the (k, 3) parameters and
+        # return it opened for writing
+        params = np.asarray(params, dtype=np.float64).reshape(-1, 3)
+        os.makedirs(path, exist_ok=True)
+        np.savez(os.path.join(path, 'index.npz'), params=params,
+                 shape=np.array(shape, dtype=np.int64))
+        mk = cls(path)
+        mk.data = np.memmap(mk.bin, dtype=np.float64, mode='w+',
+                            shape=(len(mk),) + mk.shape)
+        return mk
+
+    def open(self):
+        # Map the grids (once per process)
+        if self.data is None:
+            self.data = np.memmap(self.bin, dtype=np.float64, mode='r',
+                                  shape=(len(self),) + self.shape)
+        return self.data
+
+    def __len__(self):
+        return self.params.shape[0]
+
+    def __getitem__(self, k: int):
+        # Market grid of the scenario k
+        return self.open()[k]
+
+    def __iter__(self):
+        # Go through the scenarios as the (parameters, grid) pairs
+        for k in range(len(self)):
+            yield dict(zip(PARAMS, self.params[k])), self[k]
+
+    def find(self, price=None, inter=None, adoption=None):
+        # Number of the scenario with the given parameters, None matches
+        # anything, NaN matches the country's own value
+        mask = np.ones(len(self), dtype=bool)
+        for j, val in enumerate((price, inter, adoption)):
+            if val is not None:
+                mask &= np.isclose(self.params[:, j], val, equal_nan=True)
+        found = np.nonzero(mask)[0]
+        if found.size == 0:
+            raise KeyError('No scenario with price = {}, inter = {}, '
+                           'adoption = {}'.format(price, inter, adoption))
+        return int(found[0])
+
+    def flush(self):
+        if self.data is not None:
+            self.data.flush()
+
+    def __getstate__(self):
+        # Every process maps the file by itself
+        state = self.__dict__.copy()
+        state['data'] = None
+        return state
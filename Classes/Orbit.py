@@ -0,0 +1,80 @@
+import numpy as np
+import hashlib
+from Classes.Satellite import mu, R
+from Classes.Ephemeris import Ephemeris
+J2 = 1.08263e-3   # Second zonal harmonic of the Earth gravity field
+WE = 7.2921159e-5   # RAD/S EARTH ROTATION RATE
+
+
+class Walker:
+    # The class of the analytic circular-orbit propagator of the Walker
+    # constellation (i: n/planes/phasing) with the secular J2 drift
+
+    def __init__(self, sat, n: int, planes: int, phasing: int, inc: float,
+                 step: float, j2: bool = True, lon0: float = 0.):
+        '''
+        sat -- satellite class object (altitude)
+        n -- number of satellites in the constellation
+        planes -- number of orbital planes
+        phasing -- Walker phasing factor (0 .. planes - 1)
+        inc -- orbit inclination in degrees
+        step -- timestep size in seconds
+        j2 -- take the J2 drift of the node and the argument of latitude
+        lon0 -- Greenwich longitude of the first node at the start, degrees
+        '''
+        if n % planes != 0:
+            raise ValueError('Number of satellites is not divisible by the '
+                             'number of planes!')
+        self.n = n
+        self.step = step
+        self.inc = np.deg2rad(inc)
+
+        # Mean motion of the circular orbit
+        a = R + sat.alt
+        mm = np.sqrt(mu/a**3)
+        # Secular rates of the node and of the argument of latitude
+        k = 1.5*J2*(R/a)**2 if j2 else 0.
+        self.draan = -k*mm*np.cos(self.inc)
+        self.du = mm*(1 + k*(4*np.cos(self.inc)**2 - 1))
+
+        # Initial node and argument of latitude for every satellite
+        s = n // planes   # Satellites per plane
+        p = np.repeat(np.arange(planes), s)
+        j = np.tile(np.arange(s), planes)
+        self.raan0 = 2*np.pi*p/planes + np.deg2rad(lon0)
+        self.u0 = 2*np.pi*j/s + 2*np.pi*phasing*p/n
+
+    def key(self):
+        # Identity of the propagated constellation for the cached results
+        h = hashlib.sha1(self.raan0.tobytes() + self.u0.tobytes())
+        return ('walker', self.n, self.step, self.inc, self.draan, self.du,
+                h.hexdigest())
+
+    def positions(self, ts):
+        # Return the (k, n, 2) array of [lat, lon] for the timesteps given
+        t = np.asarray(ts, dtype=np.float64)[:, None]*self.step
+        u = self.u0[None, :] + self.du*t
+        raan = self.raan0[None, :] + (self.draan - WE)*t
+
+        out = np.empty((t.shape[0], self.n, 2), dtype=np.float32)
+        # Sub-satellite point on the rotating Earth
+        out[:, :, 0] = np.rad2deg(np.arcsin(np.sin(self.inc)*np.sin(u)))
+        lon = raan + np.arctan2(np.cos(self.inc)*np.sin(u), np.cos(u))
+        out[:, :, 1] = np.rad2deg((lon + np.pi) % (2*np.pi) - np.pi)
+        return out
+
+    def __getitem__(self, index):
+        # Access as for the ephemeris file: data[ts] or data[start:stop]
+        if isinstance(index, slice):
+            return self.positions(np.arange(index.start or 0, index.stop,
+                                            index.step or 1))
+        return self.positions([index])[0]
+
+    def write(self, path: str, steps: int, block: int = 500):
+        # Propagate the constellation to the binary ephemeris file by blocks
+        out = Ephemeris.create(path, steps, self.n, self.step)
+        for st in range(0, steps, block):
+            out[st:st + block] = self[st:min(st + block, steps)]
+        out.flush()
+        del out
+        return Ephemeris(path)
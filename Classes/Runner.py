@@ -0,0 +1,239 @@
+import numpy as np
+import os
+from multiprocessing import shared_memory
+COLS = 7   # t, coverage, revenue, ideal revenue, costs, ideal costs, density
+HEADER = "t(s), cv(%), R($), iR($), C($), iC($), d"   # Export header
+NAMES = ['t', 'cv', 'R', 'iR', 'C', 'iC', 'd']   # Binary column files
+
+
+def cumulate(out, ordered: bool = True):
+    # Post-processing of the (steps, 7) output in place: order the rows by
+    # the time axis (if needed) and calculate the cumulative sum of metrics
+    # (except coverage and timestep)
+    if not ordered:
+        out[:] = out[np.argsort(out[:, 0], kind='stable')]
+    np.cumsum(out[:, 2:], axis=0, out=out[:, 2:])
+    return out
+
+
+class Results:
+    # The class of the (steps, 7) simulation output kept in shared memory
+    # Workers write their rows straight into it at the row of the timestep
+
+    def __init__(self, steps: int, name=None, path=None):
+        '''
+        steps -- number of timesteps of the simulation
+        name -- shared memory block to attach to (create a new one if None)
+        path -- keep the output in the memory-mapped file instead (it is
+                created if it does not exist), e.g. for the checkpoints
+        '''
+        self.steps = steps
+        self.path = path
+        self.owner = name is None
+        if path is not None:
+            # File-backed buffer, the mapping is shared by the processes
+            self.shm = None
+            self.name = None
+            mode = 'r+' if os.path.isfile(path) else 'w+'
+            self.data = np.memmap(path, dtype=np.float64, mode=mode,
+                                  shape=(steps, COLS))
+            return
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=steps*COLS*8)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+        self.data = np.ndarray((steps, COLS), dtype=np.float64,
+                               buffer=self.shm.buf)
+
+    def write(self, start: int, block):
+        # Write the block of rows starting from the timestep start
+        self.data[start:start + len(block)] = block
+
+    def flush(self):
+        # Put the rows of the file-backed buffer on the disk
+        if self.shm is None:
+            self.data.flush()
+
+    def close(self):
+        # Detach from the shared memory (and free it in the owner process)
+        if self.shm is None:
+            self.data.flush()
+            del self.data
+            return
+        del self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __getstate__(self):
+        # Only the name is sent to the workers, they attach to the block
+        return {'steps': self.steps, 'name': self.name, 'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['steps'], state['name'], state['path'])
+
+
+class Shared:
+    # The class of the read-only array placed in shared memory
+    # Pickled by the name of the memory block, so workers reattach to it
+
+    def __init__(self, arr):
+        '''
+        arr -- array to be copied to shared memory
+        '''
+        arr = np.ascontiguousarray(arr)
+        self.shape = arr.shape
+        self.dtype = arr.dtype.str
+        self.owner = True
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=max(arr.nbytes, 1))
+        self.name = self.shm.name
+        self.array = np.ndarray(self.shape, dtype=self.dtype,
+                                buffer=self.shm.buf)
+        self.array[...] = arr
+        self.array.flags.writeable = False
+
+    def close(self):
+        # Detach from the shared memory (and free it in the owner process)
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __getstate__(self):
+        return {'shape': self.shape, 'dtype': self.dtype, 'name': self.name}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.owner = False
+        self.shm = shared_memory.SharedMemory(name=self.name)
+        self.array = np.ndarray(self.shape, dtype=self.dtype,
+                                buffer=self.shm.buf)
+        self.array.flags.writeable = False
+
+
+class Writer:
+    # The class of the incremental export of the output during the run
+    # Finished blocks are written as soon as all the previous ones are there
+
+    def __init__(self, path: str, binary: bool = False):
+        '''
+        path -- .csv file of the cumulative output (appended if it exists)
+        binary -- also write every column to a raw float64 file
+        '''
+        self.path = path
+        self.pending = {}   # Finished blocks waiting for the previous ones
+        self.carry = np.zeros(COLS - 2)   # Cumulative metrics so far
+        self.rows = 0   # Rows written
+
+        # Binary columns are kept in the folder named as the .csv file
+        self.cols = None
+        if binary:
+            self.cols = os.path.splitext(path)[0] + '_cols'
+            os.makedirs(self.cols, exist_ok=True)
+
+        # Continue the existing output of the interrupted run
+        if os.path.isfile(path):
+            # Ends of the whole rows of the .csv file, a partly written
+            # last row is dropped
+            with open(path, 'rb') as f:
+                ends = []
+                pos = 0
+                for line in f:
+                    pos += len(line)
+                    if line.endswith(b'\n') and not line.startswith(b'#'):
+                        ends.append(pos)
+            self.ends = ends
+            self.rows = len(ends)
+            if binary:
+                # Whole rows of every binary column
+                for name in NAMES:
+                    col = os.path.join(self.cols, name + '.bin')
+                    size = os.path.getsize(col) if os.path.isfile(col) else 0
+                    self.rows = min(self.rows, size // 8)
+            # The files are stopped at different rows if the run has been
+            # killed, keep the rows all of them have
+            self.truncate(self.rows)
+            self.csv = open(path, 'a')
+        else:
+            self.ends = []
+            self.csv = open(path, 'w')
+        if self.csv.tell() == 0:
+            self.csv.write('# ' + HEADER + '\n')
+        self.bin = None
+        if binary:
+            self.bin = [open(os.path.join(self.cols, name + '.bin'), 'ab')
+                        for name in NAMES]
+
+    def truncate(self, rows: int):
+        # Cut the existing output to the first rows (before the writing)
+        if rows > self.rows:
+            raise IndexError('Only {} rows have been written'
+                             .format(self.rows))
+        self.rows = rows
+        # Keep the header of the .csv file
+        with open(self.path, 'rb') as f:
+            head = f.readline()
+        os.truncate(self.path, self.ends[rows - 1] if rows > 0
+                    else len(head) if head.startswith(b'#') else 0)
+        self.ends = self.ends[:rows]
+        if self.cols is not None:
+            for name in NAMES:
+                col = os.path.join(self.cols, name + '.bin')
+                if os.path.isfile(col):
+                    os.truncate(col, rows*8)
+        # Cumulative metrics of the last row kept
+        self.carry = np.zeros(COLS - 2)
+        if rows > 0:
+            if self.cols is not None:
+                # Take the exact cumulative values from the binary columns
+                for j, name in enumerate(NAMES[2:]):
+                    self.carry[j] = np.fromfile(
+                        os.path.join(self.cols, name + '.bin'),
+                        offset=(rows - 1)*8, count=1)[0]
+            else:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.ends[rows - 2] if rows > 1 else 0)
+                    last = np.loadtxt(f, delimiter=',', ndmin=2)[-1]
+                self.carry = last[2:]
+
+    def add(self, start: int, block):
+        # Add the finished (non-cumulative) block of rows from the step start
+        if start < self.rows:
+            raise IndexError('Step {} has been written already'.format(start))
+        self.pending[start] = np.array(block)
+        written = False
+        while self.rows in self.pending:
+            self._write(self.pending.pop(self.rows))
+            written = True
+        # Every file ends on the same block boundary on the disk
+        if written:
+            self.sync()
+
+    def _write(self, block):
+        # Accumulate the block on top of the rows written and append it
+        cumulate(block)
+        block[:, 2:] += self.carry
+        self.carry = block[-1, 2:].copy()
+        np.savetxt(self.csv, block, delimiter=',', fmt='%1.3f')
+        if self.bin is not None:
+            for j, f in enumerate(self.bin):
+                block[:, j].tofile(f)
+        self.rows += block.shape[0]
+
+    def sync(self):
+        # Flush the written rows to the disk
+        for f in [self.csv] + (self.bin or []):
+            f.flush()
+            os.fsync(f.fileno())
+
+    def close(self):
+        if len(self.pending) > 0:
+            raise IndexError('Blocks from steps {} are not written, the '
+                             'previous steps are missing'
+                             .format(sorted(self.pending)))
+        self.sync()
+        for f in [self.csv] + (self.bin or []):
+            f.close()
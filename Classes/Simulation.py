@@ -1,8 +1,8 @@
 import numpy as np
-import os
 import _pickle as pickle
+import copy
+import hashlib
 from time import time as t
-from numpy.random import choice as rnd
 # from time import time as tt
 import datetime as dt
 # from geopy import distance
@@ -11,7 +11,16 @@ import datetime as dt
 from Classes.Helpers import Strategy
 from Classes.Helpers import Trend
 from Classes.Satellite import Satellite
-R = 6378.137
+from Classes.Coverage import Coverage
+from Classes.Coverage import Counts
+from Classes.States import Events
+from Classes.Lifetime import Lifetime
+from Classes.Ephemeris import Ephemeris
+from Classes.Ephemeris import Chunks
+from Classes.Runner import Shared
+from Classes.Runner import HEADER
+from Classes.Benchmark import Benchmark
+from Classes.Market import Market
 
 
 class Simulation:
@@ -20,7 +29,12 @@ class Simulation:
     def __init__(self, mass, volume, alfa, alt, cov,   # Sat
                  n: int,   # Constellation and service
                  strat: str,   # Classes
-                 simtime: int, step: int, acc: float):   # Simulation
+                 simtime: int, step: int, acc: float,   # Simulation
+                 stencil: bool = False, dense: bool = False,
+                 ephemeris='./PP_Data/ephemeris.bin', chunk: int = 500,
+                 seed=None, benchmark: bool = True,
+                 incremental: bool = False, market=None,
+                 scenario: int = 0):
         '''
         alt -- satellites altitude
         volume -- satellite volume
@@ -31,6 +45,23 @@ class Simulation:
         step -- timestep size of the simulation in seconds
         acc -- step of the grid
         n -- number of satellites in the constellation
+        stencil -- use the cached footprint stencils for the coverage, faster
+                   but approximate: the satellites are snapped to the grid,
+                   the revenue error depends on the constellation density
+                   (several % of the peak per step for dense ones, more for
+                   sparse ones), compare with the exact coverage first
+        dense -- keep the states as the dense (steps, n) matrix
+        ephemeris -- binary ephemeris file of the sub-satellite points or
+                     a propagator object (e.g. Walker)
+        chunk -- number of timesteps loaded at once by the worker
+        seed -- seed of the random streams (None for a new random one)
+        benchmark -- cache the ideal revenue track on disk
+        incremental -- update the coverage from the previous step, pays off
+                       for short steps (stencil mode only, so it is as
+                       approximate as the stencils)
+        market -- folder (or Market object) of the pricing scenario grids,
+                  the single grid of market.data if None
+        scenario -- number of the market scenario to start with
         '''
 
         # Create a satellite class object with appropriate parameters
@@ -48,141 +79,301 @@ class Simulation:
         self.strat = Strategy(strat, self.sat, 50*24*36)
 
         # Upload money is for money grid, lifetime is for array of lifetimes
-        with open('./PP_Data/market.data', 'rb') as f:
-            self.money = pickle.load(f)
+        if isinstance(market, str):
+            market = Market(market)
+        self.market = market
+        self.scenario = scenario
+        if market is None:
+            with open('./PP_Data/market.data', 'rb') as f:
+                self.money = pickle.load(f)
+        else:
+            self.money = np.array(market[scenario])
+        # Memory-mapped sub-satellite points, opened once per process, or
+        # the points propagated on the fly, loaded by blocks of timesteps
+        if isinstance(ephemeris, str):
+            ephemeris = Ephemeris(ephemeris)
+        # The points must be made for this constellation and timestep
+        if ephemeris.n != n or ephemeris.step != step:
+            raise ValueError('Ephemeris is made for n = {}, step = {}s, the '
+                             'simulation has n = {}, step = {}s'
+                             .format(ephemeris.n, ephemeris.step, n, step))
+        if getattr(ephemeris, 'steps', self.steps) < self.steps:
+            raise ValueError('Ephemeris has {} timesteps, the simulation '
+                             'needs {}'.format(ephemeris.steps, self.steps))
+        self.eph = Chunks(ephemeris, self.steps, chunk)
+        # Batched coverage engine for the money grid, footprint stencils
+        # are precomputed per latitude band for the whole run
+        self.cov = Coverage(self.sat, acc, self.money.shape, stencil=stencil)
+        # Ideal revenue track shared by the runs and strategies
+        self.bench = Benchmark(self) if benchmark else None
+        # Per-cell coverage counts of the incremental mode (worker-local)
+        if incremental and not stencil:
+            raise ValueError('Incremental coverage needs stencil = True!')
+        self.incremental = incremental
+        self.counts = {}
+        # Coverage union grids reused between the steps (real and ideal)
+        self.grid = np.zeros(self.money.shape, dtype=bool)
+        self.igrid = np.zeros(self.money.shape, dtype=bool)
+        # Lifetime sampler with the cumulative table cached on disk
+        self.life = Lifetime(path='./PP_Data/lifetime.npz')
+        # Random streams of the simulation, the states are sampled from the
+        # stream of the first replica
+        self.seed = np.random.SeedSequence(seed).entropy
+        self.rng = self.replica(0)
         st = t()
         self.states = self.status()
+        if dense:
+            self.states = self.states.dense()
         print('States array took {}s'.format(t() - st))
 
-    def status(self):
-        # The matrix of the distribution of the satellite workstatus over time
-        # Create an empty array
-        arr = np.empty((self.steps, self.n), dtype=np.int8)
+        # Large read-only arrays placed in shared memory by share()
+        self.shared = {}
+
+    def key(self, steps: bool = True):
+        # Key of the configuration the output depends on (except the
+        # states): the money grid, the ephemeris, the grid and the satellite
+        # steps -- include the length of the run (the ideal revenue track
+        #          does not depend on it)
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(self.money).tobytes())
+        h.update(repr((self.eph.source.key(),
+                       self.steps if steps else None, self.acc, self.step,
+                       self.sat.alt, self.sat.alfa,
+                       self.cov.stencil)).encode())
+        return h.hexdigest()
+
+    def select(self, scenario: int):
+        # Switch the simulation to the other market scenario, the states
+        # and the ephemeris stay the same
+        if self.market is None:
+            raise ValueError('No market scenarios are given!')
+        if ('money',) in self.shared:
+            raise ValueError('Unshare the simulation before the switch!')
+        self.scenario = scenario
+        self.money = np.array(self.market[scenario])
+        # Everything that depends on the money grid
+        self.counts = {}
+        if self.bench is not None:
+            self.bench = Benchmark(self)
+        return self
+
+    def scenarios(self):
+        # Go through the market scenarios, the simulation is switched to
+        # every one of them in turn, yields the number and the parameters
+        for k, (params, _) in enumerate(self.market):
+            self.select(k)
+            yield k, params
+
+    def replica(self, r: int):
+        # Independent random stream of the Monte Carlo replica r
+        return np.random.default_rng(
+            np.random.SeedSequence(self.seed, spawn_key=(0, r)))
+
+    def counter(self, r: int):
+        # Incremental coverage of the replica r (-1 for the ideal one)
+        if r not in self.counts:
+            self.counts[r] = Counts(self.cov, self.money, self.n)
+        return self.counts[r]
 
-        # Assign the launch failure probability
-        p = [.1]
-        # Create the probability matrix based on the reliability distribution
-        for i in range(1, 2207520):
-            p.append(.000120114*np.exp(-.000265681*i**.4521)/i**.5479)
-        p.append(1 - sum(p))
-        lt = rnd(range(len(p)), size=self.n, p=p)
+    def status(self, rng=None):
+        # The distribution of the satellite workstatus over time, stored as
+        # the transition events of every satellite
+        # rng -- random stream to sample from (the simulation one if None)
+        if rng is None:
+            rng = self.rng
 
-        # For every sat for every time step assign the status value
+        # Sample the lifetimes from the reliability distribution
+        lt = self.life.sample(self.n, rng)
+
+        # For every sat assign the status value starting from the event
         # 1 -- the satellite is working
         # 2 -- the satellite has been interupted
         # 3 -- the satellite expirienced the failure (no mitigation available)
         # 4 -- the satellite is being replaced
-        for sat in range(self.n):
-            for ts in range(self.steps):
-
-                if self.strat.str == 'none':
-                    if ts < lt[sat]:
-                        arr[ts, sat] = 1
-                    elif ts == lt[sat]:
-                        arr[ts, sat] = 3
-                    elif ts > lt[sat]:
-                        arr[ts, sat] = 0
-
-                elif self.strat.str == 'lod':
-                    if ts < lt[sat]:
-                        arr[ts, sat] = 1
-                    elif ts == lt[sat]:
-                        arr[ts, sat] = 2
-                        new_lt = rnd(range(2207521), size=1, p=p)
-                    elif ts > lt[sat] and ts < lt[sat] + self.strat.time:
-                        arr[ts, sat] = 4
-                    elif ts == lt[sat] + self.strat.time:
-                        arr[ts, sat] = 1
-                        lt[sat] = ts + new_lt
-
-        return arr
-
-    def coverage(self, sat, lon, lat, acc):
-        # Return the array of dots for the coverage area
-        # lat-lon is satellite antenna focus point on Earth
-
-        r = (sat.alt)*np.tan(np.pi * (sat.alfa/2)/180)   # Coverage radius
-        mdist = np.ceil(r/111)   # Maximum possible deviation in degrees
-        res = []
-        # Iterate through coords around the focus point
-        for i in np.arange(np.floor(lon-mdist), np.ceil(lon+mdist), acc):
-            for j in np.arange(np.floor(lat-mdist), np.ceil(lat+mdist), acc):
-                # Calculate the distance and decide whether the point is in
-                # the circle or not
-
-                # dist = distance.great_circle((lat, lon), (j, i)).km
-
-                rlat = np.deg2rad(lat)
-                rlon = np.deg2rad(lon)
-                ri = np.deg2rad(i)
-                rj = np.deg2rad(j)
-                dist = R*np.arccos(np.sin(rlat)*np.sin(rj) +
-                                   np.cos(rlat)*np.cos(rj)*np.cos(rlon-ri))
-                if dist <= r:
-                    res.append((i, j))
-        return res
+        # 0 -- the satellite is not working
+        sats = [np.arange(self.n)]
+        times = [np.zeros(self.n, dtype=np.int64)]
+        vals = [np.ones(self.n, dtype=np.int8)]
+        if self.strat.str == 'none':
+            # The failure step and the dead satellite afterwards
+            sats.extend([np.arange(self.n), np.arange(self.n)])
+            times.extend([lt, lt + 1])
+            vals.extend([np.full(self.n, 3), np.full(self.n, 0)])
+
+        elif self.strat.str == 'lod':
+            sat = np.arange(self.n)
+            fail = lt.copy()
+            # Every pass handles the next failure of the satellites left
+            while sat.size > 0:
+                keep = fail < self.steps
+                sat = sat[keep]
+                fail = fail[keep]
+                # Interruption, replacement and working satellite again
+                sats.extend([sat, sat, sat])
+                times.extend([fail, fail + 1, fail + self.strat.time])
+                vals.extend([np.full(sat.size, 2), np.full(sat.size, 4),
+                             np.full(sat.size, 1)])
+                # Replacement is done after the spare time and works for a
+                # newly sampled lifetime
+                fail = (fail + self.strat.time +
+                        self.life.sample(sat.size, rng))
+
+        return Events(self.n, self.steps, np.concatenate(sats),
+                      np.concatenate(times), np.concatenate(vals))
+
+    def coverage(self, lon, lat):
+        # Return the covered cells for all the satellites at once
+        # lon-lat are arrays of satellite antenna focus points on Earth
+        # Returns flat indices of the money grid and the owner satellites
+        return self.cov.cells(lon, lat)
 
     def step_sim(self, ts):
         # CACLULATING A STEP OF SIMULATION
+        return self.step_range_sim(ts, ts + 1)[0].tolist()
+
+    def step_range_sim(self, start, stop):
+        # CALCULATING THE CONTIGUOUS RANGE OF STEPS [start, stop)
+        return self.replicas_sim(start, stop, [self.states])[0]
+
+    def replicas_sim(self, start, stop, replicas):
+        # CALCULATING THE RANGE OF STEPS FOR SEVERAL STATE REALISATIONS
+        # replicas -- list of the states (events or dense) sharing the
+        # ephemeris and the money grid, the coverage is computed once
         m = Trend('poly05', 0, 0.15, 78840000/self.step, 1)   # Trend object
-        # Reset the parameters
-        cov = 0   # Coverage
-        rev = 0   # Overall revenue
-        irev = 0   # Overall ideal revenue
-        costs = 0   # Technical costs
-        icosts = 0   # Ideal technical costs
-        dens = 0   # Additional density on the altitude
-        rpts = []
-        irpts = []
-
-        # Upload the right files with a lons and lats
-        num = ts // 500
-        with open('./PP_Data/D/{}'.format(num*500), 'rb', os.O_NONBLOCK) as f:
-            d = pickle.load(f)
-
-        for i in range(self.n):
-            # Assembling and launch
-            if ts == 0:
-                costs += self.sat.launch_cost + self.sat.cost
-                icosts += self.sat.launch_cost + self.sat.cost
-
-            # Get the satellite coverage as generator
-            points = self.coverage(self.sat, d[ts - num*500, i, 1],
-                                   d[ts - num*500, i, 0], self.acc)
-            # Check the satellite state for:
-            # 1 -- operating
-            # 2 -- interrupted
-            # 4 -- on reparation
-            # 3 -- failed
-            # 0 -- not working
-            if self.states[ts, i] == 1:
-                rpts.extend(points)
-                costs += self.sat.operational_cost/2592000*self.step
-                cov += self.sat.coverage
-            elif self.states[ts, i] == 2:
-                costs += self.strat.replacement_cost
-                costs += self.strat.day/86400*self.step
-            elif self.states[ts, i] == 4:
-                costs += self.strat.day/86400*self.step
-            elif self.states[ts, i] == 3:
-                dens += self.sat.vol
-
-            irpts.extend(points)
-            icosts += self.sat.operational_cost/2592000*self.step
+        ts = np.arange(start, stop)
+        # Output array: t, coverage, revenue, ideal revenue, costs, ideal
+        # costs, density for every replica
+        out = np.zeros((len(replicas), ts.size, 7))
+        out[:, :, 0] = ts
+
+        # Count the satellites in every state for the whole range:
+        # 1 -- operating
+        # 2 -- interrupted
+        # 4 -- on reparation
+        # 3 -- failed
+        # 0 -- not working
+        states = [rep[start:stop] for rep in replicas]
+        cnt = np.stack([np.stack([(st == v).sum(1) for v in range(5)], axis=1)
+                        for st in states])
+
+        # Technical costs and ideal technical costs
+        out[:, :, 4] = cnt[:, :, 1]*self.sat.operational_cost/2592000*self.step
+        out[:, :, 4] += cnt[:, :, 2]*self.strat.replacement_cost
+        out[:, :, 4] += ((cnt[:, :, 2] + cnt[:, :, 4]) *
+                         self.strat.day/86400*self.step)
+        out[:, :, 5] = self.n*self.sat.operational_cost/2592000*self.step
+        # Assembling and launch
+        out[:, ts == 0, 4:6] += self.n*(self.sat.launch_cost + self.sat.cost)
+        out[:, :, 1] = cnt[:, :, 1]*self.sat.coverage   # Coverage
+        out[:, :, 6] = cnt[:, :, 3]*self.sat.vol   # Additional density
 
         # Time-transferring coef
         kt = self.step/2592000
-        # Get the revenue for the coverage
-        for p in set(rpts):
-            rev += self.money[int(p[0]/self.acc),
-                              int(p[1]/self.acc)]*kt
-        for p in set(irpts):
-            irev += self.money[int(p[0]/self.acc),
-                               int(p[1]/self.acc)]*kt
-
-        del d
-        # Output array
-        return [ts, cov, rev*m[ts], irev*m[ts], costs, icosts, dens]
+        money = self.money.ravel()
+        # Ideal revenue does not depend on the states, take it from the
+        # benchmark track where it has been computed before
+        bench = self.bench
+        if bench is not None and bench.step != self.step:
+            # The track has been made for the other step size
+            bench = None
+        if bench is not None:
+            ideal, have = self.bench.get(start, stop)
+        else:
+            ideal, have = np.zeros(ts.size), np.zeros(ts.size, dtype=bool)
+        # Replicas with all the satellites operating earn the ideal revenue
+        full = cnt[:, :, 1] == self.n
+        for k in range(ts.size):
+            if have[k] and full[:, k].all():
+                out[:, k, 2:4] = ideal[k]
+                continue
+            # Take the lats and lons of the step from the ephemeris block
+            d = self.eph[ts[k]]
+            if self.incremental:
+                # Update the per-cell counts with the changed cells only
+                if not have[k]:
+                    ideal[k] = self.counter(-1).update(
+                        d[:, 1], d[:, 0], np.ones(self.n, dtype=bool))*kt
+                out[:, k, 3] = ideal[k]
+                for r, st in enumerate(states):
+                    if full[r, k]:
+                        out[r, k, 2] = ideal[k]
+                    else:
+                        out[r, k, 2] = self.counter(r).update(
+                            d[:, 1], d[:, 0], st[k] == 1)*kt
+                continue
+            # Get the coverage of every satellite in one pass
+            flat, owner = self.coverage(d[:, 1], d[:, 0])
+            if not have[k]:
+                self.igrid.fill(False)
+                self.igrid.ravel()[flat] = True
+                ideal[k] = np.dot(money, self.igrid.ravel())*kt
+            out[:, k, 3] = ideal[k]
+            # Accumulate the union of the coverage of operating satellites
+            # in the boolean grid and get the revenue for every replica
+            for r, st in enumerate(states):
+                if full[r, k]:
+                    out[r, k, 2] = ideal[k]
+                    continue
+                self.grid.fill(False)
+                self.grid.ravel()[flat[st[k, owner] == 1]] = True
+                out[r, k, 2] = np.dot(money, self.grid.ravel())*kt
+        if bench is not None:
+            bench.put(start, ideal, ~have)
+
+        # Apply the market trend
+        out[:, :, 2:4] *= m[ts][None, :, None]
+        return out
+
+    def share(self):
+        # Place the large read-only arrays (money grid and states) in shared
+        # memory, the pickled simulation is then a lightweight handle that
+        # reattaches the workers to them
+        # The lifetime table is left out, the workers do not sample
+        paths = [('money',)]
+        if isinstance(self.states, Events):
+            paths += [('states', a) for a in ('key', 'times', 'vals', 'ptr')]
+        else:
+            paths.append(('states',))
+        for path in paths:
+            if path in self.shared:
+                continue
+            obj = self if len(path) == 1 else getattr(self, path[0])
+            sh = Shared(getattr(obj, path[-1]))
+            setattr(obj, path[-1], sh.array)
+            self.shared[path] = sh
+        return self
+
+    def unshare(self):
+        # Take the arrays back to the process memory and free shared memory
+        for path, sh in self.shared.items():
+            obj = self if len(path) == 1 else getattr(self, path[0])
+            setattr(obj, path[-1], np.array(sh.array))
+            sh.close()
+        self.shared = {}
+
+    def __getstate__(self):
+        # Shared arrays are sent by the names of their memory blocks only
+        state = self.__dict__.copy()
+        # Coverage counts stay in the process that made them
+        state['counts'] = {}
+        if self.shared:
+            # The handle of the workers, they do not sample the lifetimes
+            state['life'] = None
+        for path in self.shared:
+            if len(path) == 1:
+                state[path[0]] = None
+            else:
+                if state[path[0]] is getattr(self, path[0]):
+                    state[path[0]] = copy.copy(state[path[0]])
+                setattr(state[path[0]], path[1], None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Reattach to the shared arrays
+        for path, sh in self.shared.items():
+            obj = self if len(path) == 1 else getattr(self, path[0])
+            setattr(obj, path[-1], sh.array)
 
     def export(self, *args):
         # Take the array to be exported, or nothing
@@ -192,11 +383,11 @@ class Simulation:
             np.savetxt("./Output/{}.csv".format(now),
                        self.metrics, delimiter=',',
                        fmt='%1.3f',
-                       header="t(s), cv(%), R($), iR($), C($), iC($), d")
+                       header=HEADER)
         elif len(args) > 1:
             raise IndexError('Too much arguments have been passed. 1 expected')
         else:
             np.savetxt("./Output/{}.csv".format(now),
                        args[0], delimiter=',',
                        fmt='%1.3f',
-                       header="t(s), cv(%), R($), iR($), C($), iC($), d")
+                       header=HEADER)
@@ -0,0 +1,79 @@
+import numpy as np
+
+
+class Events:
+    # The class of the compact satellite states stored as transition events
+
+    def __init__(self, n: int, steps: int, sats, times, vals):
+        '''
+        n -- number of satellites in the constellation
+        steps -- number of timesteps of the simulation
+        sats -- satellite number of every event
+        times -- timestep when the event happens
+        vals -- satellite state starting from the event
+        '''
+        self.n = n
+        self.steps = steps
+        sats = np.asarray(sats, dtype=np.int64)
+        times = np.asarray(times, dtype=np.int64)
+        vals = np.asarray(vals, dtype=np.int8)
+
+        # Drop the events after the end of the simulation
+        keep = times < steps
+        sats, times, vals = sats[keep], times[keep], vals[keep]
+
+        # Sort by satellite and time, the latest event of the same timestep
+        # overrides the previous ones
+        order = np.lexsort((np.arange(sats.size), times, sats))
+        key = sats[order]*(steps + 1) + times[order]
+        last = np.append(key[1:] != key[:-1], True)
+        self.key = key[last]
+        self.times = times[order][last]
+        self.vals = vals[order][last]
+        # Beginning of the events of every satellite
+        self.ptr = np.searchsorted(self.key, np.arange(n + 1)*(steps + 1))
+
+    @property
+    def shape(self):
+        return (self.steps, self.n)
+
+    @property
+    def nbytes(self):
+        return (self.key.nbytes + self.times.nbytes +
+                self.vals.nbytes + self.ptr.nbytes)
+
+    def state(self, ts: int, sat: int):
+        # Return the state of one satellite at the timestep (binary search)
+        st, en = self.ptr[sat], self.ptr[sat + 1]
+        i = np.searchsorted(self.times[st:en], ts, side='right') - 1
+        return self.vals[st + i]
+
+    def row(self, ts: int):
+        # Return the states of all the satellites at the timestep
+        q = np.arange(self.n)*(self.steps + 1) + ts
+        return self.vals[np.searchsorted(self.key, q, side='right') - 1]
+
+    def rows(self, start: int, stop: int):
+        # Return the (stop - start, n) states of all the satellites
+        ts = np.arange(start, min(stop, self.steps))
+        q = np.arange(self.n)[None, :]*(self.steps + 1) + ts[:, None]
+        return self.vals[np.searchsorted(self.key, q, side='right') - 1]
+
+    def __getitem__(self, index):
+        # Access as for the dense array: states[ts], states[start:stop] or
+        # states[ts, sat]
+        if isinstance(index, tuple):
+            return self.state(*index)
+        if isinstance(index, slice):
+            return self.rows(index.start or 0, index.stop or self.steps)
+        return self.row(index)
+
+    def dense(self):
+        # Return the dense (steps, n) matrix of the states
+        arr = np.empty((self.steps, self.n), dtype=np.int8)
+        for sat in range(self.n):
+            st, en = self.ptr[sat], self.ptr[sat + 1]
+            ends = np.append(self.times[st + 1:en], self.steps)
+            for t0, t1, v in zip(self.times[st:en], ends, self.vals[st:en]):
+                arr[t0:t1, sat] = v
+        return arr
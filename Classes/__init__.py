@@ -2,3 +2,18 @@ from .Helpers import Trend
 from .Helpers import Strategy
 from .Simulation import Simulation
 from .Satellite import Satellite
+from .Coverage import Coverage
+from .States import Events
+from .Lifetime import Lifetime
+from .Ephemeris import Ephemeris
+from .Orbit import Walker
+from .Ephemeris import Chunks
+from .Runner import Results
+from .Runner import Shared
+from .Runner import Writer
+from .Checkpoint import Checkpoint
+from .Ensemble import Ensemble
+from .Benchmark import Benchmark
+from .Coverage import Counts
+from .Curve import Curve
+from .Market import Market
@@ -1,15 +1,16 @@
-import numpy as np
-
 # Custom classes
 import Classes
 from Classes.Helpers import Measurements as mes
 from Classes.Helpers import Visuals as viz
+from Classes.Runner import Writer
 # from Preprocessing import population_grid
 # Initiate the measurements class
 
 # Multiprocessing tools
 import multiprocessing as mp
 import os
+import signal
+import sys
 
 # Progress bar package
 import tqdm
@@ -18,7 +19,6 @@ import tqdm
 from datetime import datetime as dt
 
 
-print('Starting time is {}'.format(dt.now().strftime("%H:%M:%S")))
 # Boundary conditions
 # Satellite characteristics
 mass = 400   # Kgs dry mass
@@ -35,52 +35,118 @@ strat = 'none'
 step = int(500)   # seconds
 simtime = int(157680500)   # seconds
 tss = int(simtime/step)
+seed = None   # Random seed (None for a new one, printed in the beginning)
+
+# Continue the interrupted run from its checkpoint (if there is one)
+resume = True
 
-# CREATE A NEW INSTANCE OF SIMULATION
-sim = Classes.Simulation(mass, vol, 40, alt, 0.075,
-                         n,
-                         strat,
-                         simtime, step, 1)
 
-print('Prepared for simulation in {}'.format(dt.now().strftime("%H:%M:%S")))
+def init(handle, results):
+    # Attach the worker to the shared simulation state and output buffer
+    global sim, res
+    sim = handle
+    res = results
 
-# =============================================================================
-# # Time measurements for one step of simulation
-# time = mes.time_mes(sim, 1)
-# =============================================================================
 
-# =============================================================================
-# # Selecting the best timestep
-# mes.step_selection(sim)
-# =============================================================================
+def step_range(rng):
+    # Run the contiguous range of steps (start, stop) in the worker and
+    # write the rows straight to the shared output
+    res.write(rng[0], sim.step_range_sim(*rng))
+    return rng
+
 
 if __name__ == '__main__':
+    print('Starting time is {}'.format(dt.now().strftime("%H:%M:%S")))
+    # CREATE A NEW INSTANCE OF SIMULATION
+    sim = Classes.Simulation(mass, vol, 40, alt, 0.075,
+                             n,
+                             strat,
+                             simtime, step, 1, seed=seed)
+    print('Random seed is {}'.format(sim.seed))
+
+    print('Prepared for simulation in {}'.format(
+        dt.now().strftime("%H:%M:%S")))
+
+    # =========================================================================
+    # # Time measurements for one step of simulation
+    # time = mes.time_mes(sim, 1)
+    # =========================================================================
+
+    # =========================================================================
+    # # Selecting the best timestep
+    # mes.step_selection(sim)
+    # =========================================================================
+
+    # =========================================================================
+    # # Monte Carlo ensemble of the reliability realisations
+    # ens = Classes.Ensemble(sim, 100)
+    # ens.export(*ens.run(cpus=os.cpu_count()))
+    # =========================================================================
+
+    # Checkpoint of the sampled states, RNG and finished steps
+    ck = Classes.Checkpoint()
+    if resume and ck.exists():
+        output = ck.restore(sim, seed)
+        print('Resuming the run exported to {}'.format(output))
+    else:
+        output = './Output/{}.csv'.format(dt.now().strftime("%d-%m %H:%M"))
+        ck.save(sim, output)
+    ck.open(tss)
+
     cpus = os.cpu_count()
-    pl = mp.Pool(cpus)   # Create the pool object
-    args = range(tss)   # The amount of steps as a step array
-
-    data = []
-    # Create a proress bar
-    for i in tqdm.tqdm(pl.imap_unordered(sim.step_sim, args,
-                                         int(tss/(2*cpus) + 1)), total=tss):
-        data.append(i)
-
-    # Close & join the pool to commit the operations on multiprocessing
-    pl.close()
-    pl.join
-    out = np.array(data)
-
-    # Sorting the array by the time axis
-    sort = np.empty_like(out)
-    ind = np.argsort(out[:, 0], axis=0)
-    for i, ix in enumerate(ind):
-        for j in range(len(out[0, :])):
-            sort[i, j] = out[ix, j]
-
-    # Calculate the cumulative sum of metrics (except coverage and timestep)
-    cum = np.cumsum(sort[:, 2:], 0)
-    result = np.concatenate((sort[:, :2], cum), 1)
-
-    # Export the file
-    print('Finish time is {}'.format(dt.now().strftime("%H:%M:%S")))
-    sim.export(result)
+    # Stop on SIGTERM (e.g. preemption) through the clean-up of the run
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(1))
+    # Large read-only arrays of the simulation go to shared memory, the
+    # workers get a lightweight handle once instead of a copy per task
+    sim.share()
+    # Output buffer mapped from the checkpoint, row ts is written by the
+    # worker
+    res = ck.results(tss)
+    pl = None
+    try:
+        # Create the pool object
+        pl = mp.Pool(cpus, initializer=init, initargs=(sim, res))
+        # Contiguous ranges of steps aligned to the blocks of the ephemeris,
+        # so that the worker loads the block only once
+        args = sim.eph.ranges(0, tss)
+
+        # Ordered blocks are exported as soon as they are finished
+        out = Writer(output, binary=True)
+        # The checkpoint decides what is done: the export is cut to the last
+        # block boundary covered by the finished steps, the finished steps
+        # after it are exported again
+        out.truncate(ck.covered(args, out.rows))
+        for st, en in ck.finished(args):
+            if st >= out.rows:
+                out.add(st, res.data[st:en])
+
+        # Only the missing steps are scheduled
+        args = ck.missing(args)
+        # Create a proress bar
+        bar = tqdm.tqdm(total=tss,
+                        initial=tss - sum(en - st for st, en in args))
+        for st, en in pl.imap_unordered(step_range, args):
+            # The rows are on the disk before the range is marked done
+            res.flush()
+            ck.mark(st, en)
+            ck.flush()
+            out.add(st, res.data[st:en])
+            bar.update(en - st)
+        bar.close()
+
+        # Close & join the pool to commit the operations on multiprocessing
+        pl.close()
+        pl.join()
+
+        # Finish the export
+        out.close()
+        print('Finish time is {}'.format(dt.now().strftime("%H:%M:%S")))
+    finally:
+        # Stop the workers and free the shared memory also when the run is
+        # stopped
+        if pl is not None:
+            pl.terminate()
+        res.close()
+        sim.unshare()
+    # The run is complete, nothing to resume
+    ck.clear()
@@ -3,27 +3,20 @@ import csv
 from aeronet import dataset as ds
 import shapely
 import pickle
+import multiprocessing as mp
+import os
+from Classes.Ephemeris import Ephemeris
+from Classes.Curve import Curve
+from Classes.Market import Market
+
+# Data of the tiled job kept in the pool worker
+tile_data = {}
 
 
 def smart_interp(array, value):
-    # Runs the linear interpolation if it is necessary
-    # If there's any value that not follows the array - return Exception
-    for i in range(len(array)):
-        if value == array[i][0]:
-            toggle = True
-            return array[i][1]
-        elif value > float(array[i][0]) and value < float(array[i+1][0]):
-            y2 = float(array[i+1][1])
-            y1 = float(array[i][1])
-            x2 = float(array[i+1][0])
-            x1 = float(array[i][0])
-
-            new_y = value*(y2-y1)/(x2-x1) + (x1*y2-x2*y1)/(x1-x2)
-            toggle = True
-            return new_y
-
-    if value > array[len(array)-1][0] or value < array[0][0] or ~toggle:
-        raise Exception('Out of array range or smth else happened!')
+    # Runs the linear interpolation of the curve points
+    # If there's any value that not follows the array - raise ValueError
+    return Curve(array)(value)
 
 
 def pop_array(path):
@@ -58,19 +51,83 @@ def country(FeatureCollection, X, Y):
     return str('oth')
 
 
-def gen_countries(f_json, acc):
+def tiles(shape, size):
+    # Split the grid of a shape into the tiles of size x size cells
+    return [(slice(i, min(i + size, shape[0])), slice(j, min(j + size,
+                                                             shape[1])))
+            for i in range(0, shape[0], size)
+            for j in range(0, shape[1], size)]
+
+
+def tile_init(data):
+    # Keep the data of the tiled job in the worker
+    tile_data.update(data)
+
+
+def tile_run(job):
+    # Process one tile in the worker
+    func, tile = job
+    return tile, func(tile, **tile_data)
+
+
+def tiled(func, shape, data, dtype, size=90, cpus=None):
+    # Process the grid by tiles in the pool and stitch the results
+    # func -- func(tile, **data) returns the array for the tile
+    # data -- dictionary of the data sent once to every worker
+    out = np.empty(shape, dtype=dtype)
+    with mp.Pool(cpus, initializer=tile_init, initargs=(data,)) as pl:
+        for tile, part in pl.imap_unordered(tile_run,
+                                            [(func, tile) for tile
+                                             in tiles(shape, size)]):
+            out[tile] = part
+    return out
+
+
+def countries_tile(tile, tree, codes, acc):
+    # Classify the grid cells of the tile by the country
+    # The grid points
+    X, Y = np.meshgrid(np.arange(tile[0].start, tile[0].stop)*acc - 180,
+                       np.arange(tile[1].start, tile[1].stop)*acc - 90,
+                       indexing='ij')
+    dots = shapely.points(X.ravel(), Y.ravel())
+    # Pairs of the points and the shapes containing them
+    dot_i, shape_i = tree.query(dots, predicate='within')
+    # The first shape of the collection wins, as in country()
+    first = np.full(dots.size, len(codes) - 1)
+    np.minimum.at(first, dot_i, shape_i)
+    # The points on the grid boundary box are 'other'
+    first[((X <= -180) | (X >= 180) | (Y <= -90) | (Y >= 90)).ravel()] = \
+        len(codes) - 1
+    return codes[first].reshape(X.shape)
+
+
+def rasterize(fcol, acc, cpus=1, size=90):
+    # Classify all the grid cells by the country at once
+    # cpus -- number of processes classifying the tiles of the grid
+    # Spatial index over the prepared country shapes
+    shapes = [Feature.shape for Feature in fcol]
+    shapely.prepare(shapes)
+    tree = shapely.STRtree(shapes)
+    # Country codes, the last one is 'other' for the points outside
+    codes = np.array([str(Feature.geojson['properties']['ADM0_A3']).lower()
+                      for Feature in fcol] + ['oth'], dtype='object')
+
+    shape = (int(round(360/acc)), int(round(180/acc)))
+    if cpus == 1:
+        return countries_tile((slice(0, shape[0]), slice(0, shape[1])),
+                              tree, codes, acc)
+    return tiled(countries_tile, shape,
+                 {'tree': tree, 'codes': codes, 'acc': acc}, 'object',
+                 size, cpus)
+
+
+def gen_countries(f_json, acc, cpus=1):
     # Generate a country array based on coords
     # Open world geojson shape map
     fcol = ds.FeatureCollection.read(f_json)
-    # Generate the empty array of a shape (360, 180)
-    countries = np.empty((360, 180), dtype='object')
-
-    # Iterate through coords
-    for i in range(360):
-        for j in range(180):
-            # Determine the country and write its code to the array
-            con = country(fcol, i - 180, j - 90)
-            countries[i, j] = con
+    # Determine the country for every grid cell of a shape
+    # (360/acc, 180/acc) using the spatial index
+    countries = rasterize(fcol, acc, cpus)
 
     # Save array to the text file
     np.savetxt('./PP_Data/countries_list.txt', countries, fmt='%s',
@@ -125,41 +182,104 @@ def rp(c_data):
     return rp_data
 
 
-def static(pop, countries, c_data, rp_data, price, inter):
+def factors(names, c_data, rp_data, price, inter, adoption=None,
+            local=False):
+    # Revenue per person for every country of the list
+    # price, inter, adoption -- values or (k,) arrays of the scenarios, the
+    # result is (k, countries) for the arrays; None or NaN price (adoption)
+    # takes the average price of the internet (adoption) of the country data
+    # local -- use the data of the country itself (if there's no data for
+    # country, take the generic one), the generic 'oth' data is used for
+    # all the countries otherwise
+    codes = list(c_data[0, 1:])
+    curves = list(rp_data[0])
+    # Column of the households data by the country code
+    cd_i = np.array([codes.index(name if local and name in codes
+                                 else 'oth') + 1
+                     for name in names], dtype=np.int64)
+    # Rich-poor curve by the country code
+    rp_i = np.array([curves.index(name if local and name in curves
+                                  else 'oth')
+                     for name in names], dtype=np.int64)
+    # The average price of the internet and the adoption in the country
+    c_price = (c_data[2, cd_i]*c_data[3, cd_i]).astype(np.float64)
+    c_adopt = c_data[4, cd_i].astype(np.float64)
+    # Scenario parameters along the first axis, countries along the last
+    price, inter, adoption = [
+        np.asarray(np.nan if a is None else a, dtype=np.float64)[..., None]
+        for a in (price, inter, adoption)]
+    price = np.where(np.isnan(price), c_price, price)
+    adoption = np.where(np.isnan(adoption), c_adopt, adoption)
+    price, inter, adoption = np.broadcast_arrays(price, inter, adoption)
+    # Interp every curve for all the countries using it at once
+    rp = np.empty(price.shape)
+    for j in np.unique(rp_i):
+        k = rp_i == j
+        rp[..., k] = 1 - Curve(rp_data[1, j])(price[..., k]*12 /
+                                              inter[..., k])/100
+    return rp*price*adoption
+
+
+def static(pop, countries, c_data, rp_data, price=None, inter=0.1,
+           local=False):
     # Generate a data-grid for the market
     # pop - array of population
     # countries - array of countries grid
     # c_data - array of country-related marketing and demographic info
     # rp_data - array of rich-poor curve data grid
-    # price - service estimation price
+    # price - service estimation price (the average price of the internet
+    #         in the country if None)
     # inter - percentage of income spent on internet
-    cash_data = np.empty((360, 180))
-
-    for i in range(360):
-        for j in range(180):
-            if pop[i, j] > 0:
-                name = countries[i, j]
-                # Rich-poor
-                # TODO: rich-poor name has to be okay
-                # Find the data for rich-poor by the country code
-                rp_i = np.where(rp_data == 'oth')
-                # Find the data for households bu the country code
-                cd_i = np.where(c_data == name)
-                # If there's no data for country, take the generic one
-                if ~isinstance(cd_i, int):
-                    cd_i = np.where(c_data == 'oth')
-                # Calculate the average price of the internet
-                price = c_data[2, cd_i[1]] * c_data[3, cd_i[1]]
-                # Interp it depending on the price given
-                rp = 1 - smart_interp(rp_data[1, rp_i[1]][0],
-                                      price*12/inter)/100
-                # Assign the data to the cell
-                cash_data[i, j] = pop[i, j]*rp*price*c_data[4, cd_i[1]]
-            else:
-                cash_data[i, j] = 0
+    # local - use the data of the country of the cell, the generic one
+    #         otherwise
+    # Integer country IDs of the grid cells
+    names, ids = np.unique(countries, return_inverse=True)
+    fac = factors(names, c_data, rp_data, price, inter, local=local)
+    # Assign the data to the populated cells
+    cash_data = pop*fac[ids.reshape(pop.shape)]
+    cash_data[~(pop > 0)] = 0
     return cash_data
 
 
+def static_tile(tile, pop, countries, c_data, rp_data, price, inter, local):
+    # Generate the data-grid for the market of the tile
+    return static(pop[tile], countries[tile], c_data, rp_data, price, inter,
+                  local)
+
+
+def static_tiled(pop, countries, c_data, rp_data, price, inter, cpus=None,
+                 size=90, local=False):
+    # Generate a data-grid for the market by tiles in the process pool
+    return tiled(static_tile, pop.shape,
+                 {'pop': pop, 'countries': countries, 'c_data': c_data,
+                  'rp_data': rp_data, 'price': price, 'inter': inter,
+                  'local': local},
+                 np.float64, size, cpus)
+
+
+def scenarios(pop, countries, c_data, rp_data, prices, inters,
+              adoptions=(None,), path='./PP_Data/market', local=False):
+    # Generate the market grids for all the combinations of the scenario
+    # parameters and stack them in the memory-mapped file
+    # prices, inters, adoptions -- lists of the values (None for the price
+    # or the adoption of the country data)
+    params = np.array(np.meshgrid(
+        [np.nan if p is None else p for p in prices], inters,
+        [np.nan if a is None else a for a in adoptions], indexing='ij'),
+        dtype=np.float64).reshape(3, -1).T
+    # Integer country IDs of the grid cells
+    names, ids = np.unique(countries, return_inverse=True)
+    ids = ids.reshape(pop.shape)
+    # Revenue per person of all the scenarios at once
+    fac = factors(names, c_data, rp_data, *params.T, local=local)
+    mk = Market.create(path, params, pop.shape)
+    populated = pop > 0
+    for k in range(len(mk)):
+        mk.data[k] = np.where(populated, pop*fac[k, ids], 0)
+    mk.flush()
+    return mk
+
+
 def pickles(sim):
     with open('./PP_Data/lon12.data', 'wb') as f:
         pickle.dump(sim.lon, f)
@@ -169,7 +289,8 @@ def pickles(sim):
         pickle.dump(sim.money, f)
 
 
-def population_grid(sim):
+def population_grid(sim, path='./PP_Data/ephemeris.bin'):
+    # Write the sub-satellite points to the binary ephemeris file
     if sim.lat.shape[0] != 315361:
         lats = np.swapaxes(sim.lat, 0, 1)
         lons = np.swapaxes(sim.lon, 0, 1)
@@ -177,27 +298,31 @@ def population_grid(sim):
         lats = sim.lat
         lons = sim.lon
 
-    data = np.stack((lats, lons), axis=2)
-
-    for i in range(data.shape[0]//500):
-        with open('./PP_Data/D/{}'.format(i*500), 'wb') as f:
-            pickle.dump(data[i*500:(i+1)*500, :, :], f)
-
-    with open('./PP_Data/D/{}'.format((i+1)*500), 'wb') as f:
-            pickle.dump(data[(i+1)*500:, :, :], f)
-
-
-# Generate an array of the population based on the .asc file
-pop = pop_array('./Raw_data/pop_100/pop.asc')
-# Prepare preliminary data
-countries = np.loadtxt('./PP_Data/countries_list.txt',
-                       skiprows=1, dtype='object')
-# UNCOMMENT IF COUNTRY CODES GRID IS LOST AND NEEDS TO BE GENERATED AGAIN
-# countries = gen_countries('../Raw_data/countries.geojson', 1)
-c_data = country_data()
-rp_data = rp(c_data)
-# Generate data
-data = static(pop, countries, c_data, rp_data, 100, 0.1)
-# Save to the file
-np.savetxt('./PP_Data/marketing_vals.txt', data,
-           header='xlt = -180, ylt = -90, step = {}'.format(1), fmt='%f')
+    return Ephemeris.write(path, lats, lons, sim.step)
+
+
+if __name__ == '__main__':
+    cpus = os.cpu_count()
+    # Generate an array of the population based on the .asc file
+    pop = pop_array('./Raw_data/pop_100/pop.asc')
+    # Prepare preliminary data
+    countries = np.loadtxt('./PP_Data/countries_list.txt',
+                           skiprows=1, dtype='object')
+    # UNCOMMENT IF COUNTRY CODES GRID IS LOST AND NEEDS TO BE GENERATED AGAIN
+    # countries = gen_countries('../Raw_data/countries.geojson', 1, cpus)
+    # UNCOMMENT TO IMPORT THE GMAT LAT/ LON OUTPUT TO THE BINARY EPHEMERIS
+    # Ephemeris.from_text('./PP_Data/Propagation_data/lat.txt',
+    #                     './PP_Data/Propagation_data/lon.txt',
+    #                     './PP_Data/ephemeris.bin', 500)
+    c_data = country_data()
+    rp_data = rp(c_data)
+    # Generate data
+    data = static(pop, countries, c_data, rp_data, None, 0.1)
+    # Save to the files
+    np.savetxt('./PP_Data/marketing_vals.txt', data,
+               header='xlt = -180, ylt = -90, step = {}'.format(1), fmt='%f')
+    with open('./PP_Data/market.data', 'wb') as f:
+        pickle.dump(data, f)
+    # UNCOMMENT TO GENERATE THE MARKET GRIDS OF THE PRICING SCENARIOS
+    # scenarios(pop, countries, c_data, rp_data, [None, 50, 100, 150],
+    #           [0.05, 0.1], [None, 0.5])